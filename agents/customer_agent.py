@@ -1,5 +1,7 @@
 # Imports
 import os
+import re
+import operator
 import uuid
 import requests
 import sys
@@ -10,15 +12,15 @@ from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmb
 from langchain_community.vectorstores import Chroma
 from langchain_community.document_loaders import CSVLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.chains import RetrievalQA
+from langchain.chains.question_answering import load_qa_chain
 from langgraph.graph import MessagesState, StateGraph, START, END
 from langgraph.checkpoint.memory import MemorySaver
-from langchain_core.messages import AIMessage, HumanMessage
-from typing import List, Optional
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage
+from typing import Annotated, Any, Dict, List, Optional, Tuple
 from pydantic import BaseModel
 from langchain_community.document_loaders import PyPDFLoader, TextLoader
 from langchain import hub
-from rag.rag_module import load_document_for_qa, ask_document_question, get_document_status, clear_current_document
+from rag.rag_module import retrieval_settings, retrieve_context, load_document_for_qa, ask_document_question, get_document_status, clear_current_document
 
 # Load environment variables
 from dotenv import load_dotenv
@@ -31,10 +33,17 @@ if GOOGLE_API_KEY:
 
 llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash-001")
 
+# FAQ retrieval limits from FAQ_K, FAQ_MIN_RELEVANCE and FAQ_TOKEN_BUDGET
+FAQ_RETRIEVAL = retrieval_settings("FAQ")
+
 class Schema(MessagesState):
     question: str
     status: str
+    intents: Optional[List[str]] = None
+    intent_questions: Optional[Dict[str, str]] = None
     escalation_status: Optional[str] = None
+    # Estimated prompt tokens per retrieval branch, merged across parallel branches
+    prompt_tokens: Annotated[Dict[str, Dict[str, Any]], operator.or_]
     order_id: Optional[str] = None
     complaint_id: Optional[str] = None
 
@@ -43,32 +52,151 @@ class RAG(BaseModel):
     doc_path: str
     question: str
 
-# Extract intent from latest message
-def extract_intent(state: Schema):
-    last_message = state["messages"][-1].content.lower()
-    
+# Clause separators used to spot several requests in one message, including sentence ends
+INTENT_SEPARATORS = re.compile(r"\band\b|\balso\b|[,;?!]|\.(?=\s|$)", re.IGNORECASE)
+ORDER_ID_PATTERN = re.compile(r"\bORD\d+\b", re.IGNORECASE)
+
+FAQ_KEYWORDS = ["how many", "how long", "what is", "what's", "when", "where", "why", "policy", "days", "time", "hours"]
+QUESTION_WORDS = ["what", "what's", "how", "when", "where", "why", "which", "can i", "do you", "does", "is there", "are there"]
+
+# Store-wide topics; a question about the order itself ("why is it late?") stays with track/complaint
+FAQ_TOPICS = ["store", "policy", "hours", "holidays", "warranty", "shipping", "delivery", "refund",
+              "discount", "coupon", "coupons", "loyalty", "payment", "pickup", "gift"]
+
+# Intent -> graph node
+INTENT_NODES = {
+    "faq": "faq",
+    "rag": "rag",
+    "complaint": "complaint",
+    "track": "order_track",
+    "escalate": "escalate"
+}
+
+def _contains(text: str, words: List[str]) -> bool:
+    return any(word in text for word in words)
+
+def _mentions(text: str, words: List[str]) -> bool:
+    return any(re.search(rf"\b{re.escape(word)}\b", text) for word in words)
+
+def classify_clause(text: str, match=_contains) -> Optional[str]:
+    """Classify text with the given keyword matcher, returning None when nothing specific matches."""
     # More specific intent detection with priority order
-    if ("complaint" in last_message or "complain" in last_message) and ("submit" in last_message or "file" in last_message):
-        state["status"] = "complaint"
-    elif ("return" in last_message or "exchange" in last_message) and ("want" in last_message or "can i" in last_message or "how to" in last_message or "need to" in last_message):
-        state["status"] = "complaint"
-    elif ("track" in last_message or "status" in last_message) and ("order" in last_message):
-        state["status"] = "track"
-    elif "escalate" in last_message or "escalation" in last_message:
-        state["status"] = "escalate"
-    elif any(word in last_message for word in ["document", "file", "pdf", "csv", "txt", "upload", "load"]) or "document" in last_message:
-        state["status"] = "rag"
-    elif any(word in last_message for word in ["how many", "how long", "what is", "when", "where", "why", "policy", "days", "time", "hours"]):
-        state["status"] = "faq"
-    else:
-        state["status"] = "faq"
-    
+    if match(text, ["complaint", "complain"]) and match(text, ["submit", "file"]):
+        return "complaint"
+    elif match(text, ["return", "exchange"]) and match(text, ["want", "can i", "how to", "need to"]):
+        return "complaint"
+    elif match(text, ["track", "status"]) and match(text, ["order"]):
+        return "track"
+    elif match(text, ["escalate", "escalation"]):
+        return "escalate"
+    elif match(text, ["document", "file", "pdf", "csv", "txt", "upload", "load"]):
+        return "rag"
+    elif match(text, FAQ_KEYWORDS):
+        return "faq"
+    return None
+
+def intent_question(state: Schema, intent: str, default: Optional[str] = None) -> str:
+    """The part of the message that produced an intent, falling back to the whole question."""
+    return (state.get("intent_questions") or {}).get(intent) or default or state["question"]
+
+def _clause_spans(message: str) -> List[Tuple[int, int]]:
+    """Start and end of every non-empty clause between INTENT_SEPARATORS."""
+    spans = []
+    start = 0
+    for separator in list(INTENT_SEPARATORS.finditer(message)) + [None]:
+        end = separator.start() if separator else len(message)
+        clause = message[start:end]
+        if clause.strip():
+            offset = len(clause) - len(clause.lstrip())
+            spans.append((start + offset, start + len(clause.rstrip())))
+        start = separator.end() if separator else end
+    return spans
+
+def _secondary_intent(text: str, primary: str) -> Optional[str]:
+    """Intent a clause adds next to the primary one, or None if it belongs to the primary request."""
+    intent = classify_clause(text, _mentions)
+    if not intent or intent == primary:
+        return None
+    if intent == "faq":
+        # An FAQ branch needs an actual question, and next to an order request a store-wide topic
+        if not _mentions(text, QUESTION_WORDS):
+            return None
+        if primary in ["track", "complaint"] and not _mentions(text, FAQ_TOPICS):
+            return None
+    return intent
+
+# Extract intents from latest message
+def extract_intent(state: Schema):
+    message = state["messages"][-1].content
+    last_message = message.lower()
+
+    # The whole message keeps the original single-intent route
+    primary = classify_clause(last_message) or "faq"
+    intents = [primary]
+    intent_questions = {primary: message}
+
+    # Other clauses may add intents, e.g. "track order ORD456 and what's your return policy"
+    spans = _clause_spans(message)
+    secondary_spans = []
+    for i, (start, end) in enumerate(spans):
+        clause = message[start:end]
+        intent = _secondary_intent(clause.lower(), primary)
+        if intent and intent not in intents:
+            intents.append(intent)
+            intent_questions[intent] = clause
+            secondary_spans.append(i)
+
+    if secondary_spans:
+        # Cut the secondary clauses and the separators that join them out of the original text
+        keep = [True] * len(message)
+        for i in secondary_spans:
+            later_kept = any(j not in secondary_spans for j in range(i + 1, len(spans)))
+            if i > 0:
+                cut_start, cut_end = spans[i - 1][1], spans[i][1] if later_kept else len(message)
+            else:
+                cut_start, cut_end = 0, spans[1][0] if len(spans) > 1 else len(message)
+            keep[cut_start:cut_end] = [False] * (cut_end - cut_start)
+        primary_question = "".join(char for char, kept in zip(message, keep) if kept).strip()
+        intent_questions[primary] = primary_question or message
+
+    state["status"] = primary
+    state["intents"] = intents
+    state["intent_questions"] = intent_questions
+
+    # An order ID written in the message wins over any default
+    match = ORDER_ID_PATTERN.search(message)
+    if match:
+        state["order_id"] = match.group(0).upper()
+
     return state
 
+def route_intents(state: Schema):
+    """Fan out to every detected intent; LangGraph runs these nodes in the same step."""
+    intents = state.get("intents") or [state["status"]]
+    # Escalation needs the complaint ID, so it runs after the complaint instead
+    if "complaint" in intents:
+        intents = [intent for intent in intents if intent != "escalate"]
+    return intents
+
+def after_complaint(state: Schema):
+    return "escalate" if "escalate" in (state.get("intents") or []) else "merge_replies"
+
+def merge_replies(state: Schema):
+    """Combine the replies produced by parallel branches into a single response."""
+    last_human = max((i for i, msg in enumerate(state["messages"]) if msg.type == "human"), default=-1)
+    replies = [msg for msg in state["messages"][last_human + 1:] if isinstance(msg, AIMessage)]
+
+    if len(replies) < 2:
+        return {"messages": []}
+
+    merged = "\n\n".join(msg.content for msg in replies)
+    return {"messages": [RemoveMessage(id=msg.id) for msg in replies] + [AIMessage(content=merged)]}
+
 def rag(state: Schema):
     """RAG function for document Q&A using the separate RAG module."""
     try:
-        user_input = state["question"].lower()
+        question = intent_question(state, "rag")
+        user_input = question.lower()
         
         if "document status" in user_input or ("status" in user_input and "document" in user_input):
             status = get_document_status()
@@ -92,10 +220,13 @@ def rag(state: Schema):
             return {"messages": state["messages"] + [AIMessage(content=result["message"])]}
         
         else:
-            result = ask_document_question(state["question"])
+            result = ask_document_question(question)
             
             if result["success"]:
-                return {"messages": state["messages"] + [AIMessage(content=result["answer"])]}
+                return {
+                    "messages": state["messages"] + [AIMessage(content=result["answer"])],
+                    "prompt_tokens": {"rag": result["prompt_tokens"]}
+                }
             else:
                 # If no document is loaded, prompt user to load one
                 message = result["message"] + "\n\nTo load a document, say 'load document' or mention a file type (PDF, CSV, TXT)."
@@ -122,23 +253,19 @@ def faq(state: Schema):
         embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
         vectorstore = Chroma.from_documents(docs, embeddings)
 
-        # Retrieval QA chain
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=llm,
-            chain_type="stuff",
-            retriever=vectorstore.as_retriever(search_kwargs={"k": 3}),
-            return_source_documents=False
-        )
+        # Stuff only the deduplicated, budget-trimmed chunks into the prompt
+        qa_chain = load_qa_chain(llm, chain_type="stuff")
         
-        question = state["question"]
-        response = qa_chain.invoke({"query": question})
+        question = intent_question(state, "faq")
+        context_docs, report = retrieve_context(vectorstore, question, **FAQ_RETRIEVAL)
+        response = qa_chain.invoke({"input_documents": context_docs, "question": question})
         
-        if isinstance(response, dict) and "result" in response:
-            answer = response["result"]
+        if isinstance(response, dict) and "output_text" in response:
+            answer = response["output_text"]
         else:
             answer = str(response)
         
-        return {"messages": state["messages"] + [AIMessage(content=answer)]}
+        return {"messages": state["messages"] + [AIMessage(content=answer)], "prompt_tokens": {"faq": report}}
         
     except Exception as e:
         print(f"Error processing CSV: {str(e)}")
@@ -155,7 +282,7 @@ def complaint(state: Schema):
     payload = {
         "id": complaint_id,
         "order_id": str(state["order_id"]), 
-        "issue": state["messages"][-1].content
+        "issue": intent_question(state, "complaint", state["messages"][-1].content)
     }
     
     try:
@@ -195,7 +322,7 @@ def escalate(state: Schema):
     url = "http://localhost:8000/escalations"
     payload = {
         "complaint_id": state["complaint_id"],
-        "reason": state["messages"][-1].content
+        "reason": intent_question(state, "escalate", state["messages"][-1].content)
     }
     
     try:
@@ -223,24 +350,17 @@ workflow.add_node("complaint", complaint)
 workflow.add_node("order_track", order_track)
 workflow.add_node("escalate", escalate)
 workflow.add_node("summarizer", summarizer)
+# Deferred so it waits for every branch, including escalations that follow a complaint
+workflow.add_node("merge_replies", merge_replies, defer=True)
 
 workflow.add_edge(START, "extract_intent")
-workflow.add_conditional_edges(
-    "extract_intent",
-    lambda state: state["status"],
-    {
-        "faq": "faq",
-        "rag": "rag",
-        "complaint": "complaint",
-        "track": "order_track",
-        "escalate": "escalate"
-    }
-)
-workflow.add_edge("faq", END)
-workflow.add_edge("rag", END)
-workflow.add_edge("complaint", END)
-workflow.add_edge("order_track", END)
-workflow.add_edge("escalate", END)
+workflow.add_conditional_edges("extract_intent", route_intents, INTENT_NODES)
+workflow.add_edge("faq", "merge_replies")
+workflow.add_edge("rag", "merge_replies")
+workflow.add_conditional_edges("complaint", after_complaint, {"escalate": "escalate", "merge_replies": "merge_replies"})
+workflow.add_edge("order_track", "merge_replies")
+workflow.add_edge("escalate", "merge_replies")
+workflow.add_edge("merge_replies", END)
 
 graph = workflow.compile(checkpointer=checkpointer)
 
@@ -254,6 +374,7 @@ def run_customer_service():
     print("- Document Q&A: 'load document', 'ask about document', 'document status', 'clear document'")
     print("- General FAQ: ask any question")
     print("- Escalation: 'escalate my complaint'")
+    print("- Several requests at once: 'track order ORD456 and what's your return policy'")
     print("\nDocument Q&A Commands:")
     print("- 'load document' - Load a new document for Q&A")
     print("- 'document status' - Check if a document is loaded")
@@ -289,7 +410,8 @@ def run_customer_service():
                 ("complaint" in user_input_lower and ("file" in user_input_lower or "submit" in user_input_lower))
             )
             
-            if needs_order_id:
+            # An order ID in the message is used as-is, so only prompt when there is none
+            if needs_order_id and not ORDER_ID_PATTERN.search(user_input):
                 order_input = input("📦 Order ID (press Enter for ORD123): ").strip()
                 order_id = order_input if order_input else "ORD123"
             
@@ -299,6 +421,7 @@ def run_customer_service():
                 "question": user_input,
                 "order_id": order_id,
                 "status": "",  # Reset status
+                "intents": [],  # Reset detected intents
                 "complaint_id": None,  # Reset complaint ID
                 "escalation_status": None  # Reset escalation status
             }
@@ -310,6 +433,9 @@ def run_customer_service():
 
             assistant_responded = False
             
+            for intent, report in result.get("prompt_tokens", {}).items():
+                print(f"📊 {intent} prompt tokens (est.): {report['tokens_before']} -> {report['tokens_after']}")
+            
             for msg in result["messages"]:
                 if isinstance(msg, AIMessage):
                     print(f"🤖 Assistant: {msg.content}")
@@ -1,17 +1,132 @@
 # RAG Module for Document Q&A
 import os
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain_community.document_loaders import CSVLoader, PyPDFLoader, TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.chains import RetrievalQA
+from langchain.chains.question_answering import load_qa_chain
+from langchain_core.documents import Document
+
+# Retrieval defaults shared by document Q&A and the FAQ node
+DEFAULT_K = 3
+# No cutoff or budget by default: only overlap is deduplicated, filtering and trimming are opt-in
+DEFAULT_MIN_RELEVANCE: Optional[float] = None
+DEFAULT_TOKEN_BUDGET: Optional[int] = None
+CHARS_PER_TOKEN = 4
+MIN_OVERLAP_CHARS = 20
+
+def retrieval_settings(prefix: str) -> Dict[str, Any]:
+    """Read k, relevance cutoff and token budget from <prefix>_K, <prefix>_MIN_RELEVANCE and <prefix>_TOKEN_BUDGET."""
+    min_relevance = os.getenv(f"{prefix}_MIN_RELEVANCE")
+    token_budget = os.getenv(f"{prefix}_TOKEN_BUDGET")
+    return {
+        "k": int(os.getenv(f"{prefix}_K", DEFAULT_K)),
+        "min_relevance": float(min_relevance) if min_relevance else DEFAULT_MIN_RELEVANCE,
+        "token_budget": int(token_budget) if token_budget else DEFAULT_TOKEN_BUDGET,
+    }
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token) that needs no API call."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def _overlap_length(head: str, tail: str) -> int:
+    """Length of the longest suffix of head that is also a prefix of tail."""
+    for size in range(min(len(head), len(tail)), MIN_OVERLAP_CHARS - 1, -1):
+        if head.endswith(tail[:size]):
+            return size
+    return 0
+
+def _strip_overlap(text: str, kept: List[str]) -> str:
+    """Remove text already present in kept chunks, including splitter overlap at either end."""
+    for other in kept:
+        if text in other:
+            return ""
+        text = text[_overlap_length(other, text):]
+        overlap = _overlap_length(text, other)
+        if overlap:
+            text = text[:-overlap]
+    return text.strip()
+
+def compress_context(
+    scored_docs: List[Tuple[Document, float]],
+    question: str = "",
+    min_relevance: Optional[float] = DEFAULT_MIN_RELEVANCE,
+    token_budget: Optional[int] = DEFAULT_TOKEN_BUDGET,
+) -> Tuple[List[Document], Dict[str, Any]]:
+    """Deduplicate, optionally filter and trim retrieved chunks before they are stuffed into the prompt."""
+    if token_budget is not None and token_budget <= 0:
+        raise ValueError(f"token_budget must be positive, got {token_budget}")
+
+    question_tokens = estimate_tokens(question)
+    scored_docs = sorted(scored_docs, key=lambda pair: pair[1], reverse=True)
+
+    # Always keep the best hit so a cutoff never leaves the LLM without context
+    relevant = [
+        pair for i, pair in enumerate(scored_docs)
+        if i == 0 or min_relevance is None or pair[1] >= min_relevance
+    ]
+
+    kept_texts: List[str] = []
+    docs: List[Document] = []
+    remaining = token_budget
+    for doc, _ in relevant:
+        text = _strip_overlap(doc.page_content, kept_texts)
+        if not text:
+            continue
+
+        trimmed = remaining is not None and estimate_tokens(text) > remaining
+        if trimmed:
+            cut = remaining * CHARS_PER_TOKEN
+            # Back up to the previous space unless the cut already ends a word
+            if text[cut].isspace() or " " not in text[:cut]:
+                text = text[:cut]
+            else:
+                text = text[:cut].rsplit(" ", 1)[0]
+
+        kept_texts.append(text)
+        docs.append(Document(page_content=text, metadata=doc.metadata))
+        if remaining is not None:
+            remaining -= estimate_tokens(text)
+
+        # Nothing after a trimmed chunk fits, and a leftover budget would only add fragments
+        if trimmed or remaining == 0:
+            break
+
+    report = {
+        "chunks_before": len(scored_docs),
+        "chunks_after": len(docs),
+        "tokens_before": question_tokens + sum(estimate_tokens(doc.page_content) for doc, _ in scored_docs),
+        "tokens_after": question_tokens + sum(estimate_tokens(doc.page_content) for doc in docs),
+    }
+    return docs, report
+
+def retrieve_context(
+    vectorstore,
+    question: str,
+    k: int = DEFAULT_K,
+    min_relevance: Optional[float] = DEFAULT_MIN_RELEVANCE,
+    token_budget: Optional[int] = DEFAULT_TOKEN_BUDGET,
+) -> Tuple[List[Document], Dict[str, Any]]:
+    """Retrieve up to k chunks for a question and compress them; the report is returned to the caller."""
+    scored_docs = vectorstore.similarity_search_with_relevance_scores(question, k=k)
+    return compress_context(scored_docs, question, min_relevance, token_budget)
 
 class RAG:
-    def __init__(self, model_name: str = "gemini-2.0-flash-001", embedding_model: str = "models/embedding-001"):
-        """Initialize the RAG system with model and embedding model."""
+    def __init__(
+        self,
+        model_name: str = "gemini-2.0-flash-001",
+        embedding_model: str = "models/embedding-001",
+        k: int = DEFAULT_K,
+        min_relevance: Optional[float] = DEFAULT_MIN_RELEVANCE,
+        token_budget: Optional[int] = DEFAULT_TOKEN_BUDGET,
+    ):
+        """Initialize the RAG system with model, embedding model and retrieval limits."""
         self.llm = ChatGoogleGenerativeAI(model=model_name)
         self.embeddings = GoogleGenerativeAIEmbeddings(model=embedding_model)
+        self.k = k
+        self.min_relevance = min_relevance
+        self.token_budget = token_budget
         self.vectorstore = None
         self.qa_chain = None
         self.curr_doc = None
@@ -53,12 +168,7 @@ class RAG:
 
             self.vectorstore = Chroma.from_documents(chunks, self.embeddings)
 
-            self.qa_chain = RetrievalQA.from_chain_type(
-                llm=self.llm,
-                chain_type="stuff",
-                retriever=self.vectorstore.as_retriever(search_kwargs={"k": 3}),
-                return_source_documents=False
-            )
+            self.qa_chain = load_qa_chain(self.llm, chain_type="stuff")
 
             self.curr_doc = doc_path
             self.is_loaded = True
@@ -83,16 +193,18 @@ class RAG:
             }
         
         try:
-            response = self.qa_chain.invoke({"query": question})
+            docs, report = retrieve_context(self.vectorstore, question, self.k, self.min_relevance, self.token_budget)
+            response = self.qa_chain.invoke({"input_documents": docs, "question": question})
             
-            if isinstance(response, dict) and "result" in response:
-                answer = response["result"]
+            if isinstance(response, dict) and "output_text" in response:
+                answer = response["output_text"]
             else:
                 answer = str(response)
             
             return {
                 "success": True,
-                "answer": answer
+                "answer": answer,
+                "prompt_tokens": report
             }
         
         except Exception as e:
@@ -120,7 +232,7 @@ _rag_instance: Optional[RAG] = None
 def get_rag_instance() -> RAG:
     global _rag_instance
     if _rag_instance is None:
-        _rag_instance = RAG()
+        _rag_instance = RAG(**retrieval_settings("RAG"))
     return _rag_instance
 
 def load_document_for_qa(doc_path: str) -> Dict[str, Any]:
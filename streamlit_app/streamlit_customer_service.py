@@ -5,7 +5,7 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from langchain_core.messages import AIMessage, HumanMessage
-from agents.customer_agent import extract_intent, faq, complaint, order_track, escalate, summarizer, rag, Schema, graph
+from agents.customer_agent import extract_intent, Schema, graph
 from rag.rag_module import load_document_for_qa, get_document_status, clear_current_document
 
 st.set_page_config(page_title="Customer Service Agent", page_icon="🎧")
@@ -91,46 +91,37 @@ if st.button("Send") and user_input.strip():
         question=user_input,
         order_id=None,
         status="",
+        intents=[],
         complaint_id=None,
         escalation_status=None
     )
     state = extract_intent(state)
     
-    # Use user-provided order ID or default
-    if state["status"] in ["complaint", "track"]:
+    # Use user-provided order ID or default, unless the message already names one
+    if any(intent in ["complaint", "track"] for intent in state["intents"]) and not state.get("order_id"):
         if st.session_state.show_order_input and "order_id_input" in st.session_state and st.session_state.order_id_input:
             state["order_id"] = st.session_state.order_id_input
         else:
             state["order_id"] = "ORD123"  # fallback default
     
-    # For escalation, use stored complaint ID
-    if state["status"] == "escalate":
+    # For escalation, use stored complaint ID unless this message files the complaint first
+    if "escalate" in state["intents"] and "complaint" not in state["intents"]:
         state["complaint_id"] = st.session_state.current_complaint_id
     
-    # Run the correct node
-    if state["status"] == "faq":
-        result = faq(state)
-    elif state["status"] == "rag":
-        result = rag(state)
-    elif state["status"] == "complaint":
-        result = complaint(state)
-    elif state["status"] == "track":
-        result = order_track(state)
-    elif state["status"] == "escalate":
-        result = escalate(state)
-    else:
-        result = {"messages": state["messages"] + [AIMessage(content="I'm here to help! Please let me know what you need assistance with.")]}
+    # Run every detected intent through the workflow, which merges their replies
+    thread = {"configurable": {"thread_id": f"session_{uuid.uuid4()}"}}
+    result = graph.invoke(state, config=thread)
     
     # Add AI response to chat history
     for msg in result["messages"][len(st.session_state.chat_history):]:
         st.session_state.chat_history.append(msg)
     
     # Store complaint ID if a complaint was filed
-    if state["status"] == "complaint" and "complaint_id" in result:
+    if "complaint" in state["intents"] and result.get("complaint_id"):
         st.session_state.current_complaint_id = result["complaint_id"]
     
     # Reset order input visibility after processing
-    if state["status"] in ["complaint", "track"]:
+    if any(intent in ["complaint", "track"] for intent in state["intents"]):
         st.session_state.show_order_input = False
 
 # Display chat history
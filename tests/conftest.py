@@ -0,0 +1,7 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The agent builds its Gemini clients at import time; tests never call them
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
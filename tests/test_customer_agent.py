@@ -0,0 +1,138 @@
+import time
+import uuid
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage
+
+import agents.customer_agent as agent
+
+DELAY = 0.5
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self.payload = payload
+        self.status_code = status_code
+        self.text = str(payload)
+
+    def json(self):
+        return self.payload
+
+
+class FakeVectorstore:
+    def similarity_search_with_relevance_scores(self, question, k=4):
+        return [(Document(page_content="Returns are accepted within 30 days of purchase."), 0.9)]
+
+
+class SlowQAChain:
+    def invoke(self, inputs):
+        time.sleep(DELAY)
+        return {"output_text": "Returns are accepted within 30 days."}
+
+
+@pytest.fixture
+def fake_backends(monkeypatch):
+    """Order API and FAQ LLM that each take DELAY seconds; returns the payloads POSTed to the API."""
+    def slow_get(url, *args, **kwargs):
+        time.sleep(DELAY)
+        return FakeResponse({"order_id": url.rsplit("/", 1)[-1], "status": "Shipped"})
+
+    def post(url, json=None, *args, **kwargs):
+        posted.append(json)
+        return FakeResponse(json)
+
+    posted = []
+
+    monkeypatch.setattr(agent.requests, "get", slow_get)
+    monkeypatch.setattr(agent.requests, "post", post)
+    monkeypatch.setattr(agent, "GoogleGenerativeAIEmbeddings", lambda **kwargs: None)
+    monkeypatch.setattr(agent.Chroma, "from_documents", lambda docs, embeddings: FakeVectorstore())
+    monkeypatch.setattr(agent, "load_qa_chain", lambda llm, chain_type: SlowQAChain())
+    return posted
+
+
+def run(message, **state):
+    thread = {"configurable": {"thread_id": f"test_{uuid.uuid4()}"}}
+    initial_state = {"messages": [HumanMessage(content=message)], "question": message, "status": "", "intents": []}
+    initial_state.update(state)
+    return agent.graph.invoke(initial_state, config=thread)
+
+
+def intents_for(message):
+    state = {"messages": [HumanMessage(content=message)], "question": message}
+    return agent.extract_intent(state)
+
+
+@pytest.mark.parametrize("message, intents", [
+    ("track order ORD456 and what's your return policy", ["track", "faq"]),
+    ("file a complaint about order ORD1 and escalate it", ["complaint", "escalate"]),
+    ("track my order, it's been some time", ["track"]),
+    ("where is my order? track order status", ["track"]),
+    ("i want to return this, sometimes it breaks", ["complaint"]),
+    ("what are your store hours?", ["faq"]),
+    ("file a complaint about order ORD1 and escalate my complaint", ["complaint", "escalate"]),
+    ("track order ORD456 and what's the status of my document", ["track", "rag"]),
+    ("track my order ORD7, why is it late?", ["track"]),
+])
+def test_extract_intent(message, intents):
+    assert intents_for(message)["intents"] == intents
+
+
+def test_extract_intent_splits_questions_per_intent():
+    state = intents_for("track order ORD456 and what's your return policy")
+
+    assert state["intent_questions"] == {"track": "track order ORD456", "faq": "what's your return policy"}
+    assert state["order_id"] == "ORD456"
+
+
+@pytest.mark.parametrize("message, questions", [
+    ("I want to return the shoes and the shirt, also what are your store hours?",
+     {"complaint": "I want to return the shoes and the shirt", "faq": "what are your store hours"}),
+    ("file a complaint: the box was damaged, and the item is broken. what's the warranty?",
+     {"complaint": "file a complaint: the box was damaged, and the item is broken", "faq": "what's the warranty"}),
+    ("what's your return policy? track order ORD456",
+     {"track": "track order ORD456", "faq": "what's your return policy"}),
+])
+def test_primary_question_keeps_original_text(message, questions):
+    assert intents_for(message)["intent_questions"] == questions
+
+
+def test_order_id_in_message_wins_over_default():
+    state = {"messages": [HumanMessage(content="track order ORD456")], "question": "track order ORD456", "order_id": "ORD123"}
+
+    assert agent.extract_intent(state)["order_id"] == "ORD456"
+
+
+def test_branches_run_in_parallel_and_merge(fake_backends):
+    start = time.perf_counter()
+    result = run("track order ORD456 and what's your return policy")
+    elapsed = time.perf_counter() - start
+
+    # Two DELAY branches: concurrent runs take about one delay, sequential ones two
+    assert elapsed < 1.6 * DELAY
+
+    replies = [msg for msg in result["messages"] if isinstance(msg, AIMessage)]
+    assert len(replies) == 1
+    assert "ORD456" in replies[0].content
+    assert "Returns are accepted within 30 days." in replies[0].content
+
+
+def test_escalation_runs_after_complaint(fake_backends):
+    result = run("file a complaint about order ORD1 and escalate it")
+
+    replies = [msg for msg in result["messages"] if isinstance(msg, AIMessage)]
+    assert len(replies) == 1
+    assert "Complaint submitted successfully" in replies[0].content
+    assert "Complaint escalated successfully!" in replies[0].content
+    assert result["complaint_id"]
+    assert fake_backends[0]["issue"] == "file a complaint about order ORD1"
+    assert fake_backends[1]["reason"] == "escalate it"
+
+
+def test_faq_reports_prompt_tokens(fake_backends):
+    result = run("what's your return policy?")
+
+    report = result["prompt_tokens"]["faq"]
+    assert report["chunks_after"] == 1
+    assert report["tokens_after"] <= report["tokens_before"]
@@ -0,0 +1,203 @@
+import pytest
+import os
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import CSVLoader
+from langchain_core.documents import Document
+
+from rag.rag_module import RAG, compress_context, estimate_tokens, retrieval_settings, retrieve_context
+
+ANSWER = "Items can be returned within 30 days of purchase with the original receipt."
+
+
+def splitter_chunks():
+    """Adjacent chunks as the 1000/200 splitter produces them for a long document."""
+    text = " ".join(f"sentence{i} about store policies." for i in range(120))
+    text = text.replace("sentence60 about store policies.", ANSWER)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    return [doc.page_content for doc in splitter.split_documents([Document(page_content=text)])]
+
+
+class FakeVectorstore:
+    def __init__(self, scored_docs):
+        self.scored_docs = scored_docs
+
+    def similarity_search_with_relevance_scores(self, question, k=4):
+        return self.scored_docs[:k]
+
+
+class RecordingQAChain:
+    """Stands in for the stuff chain; answers only if the answer-bearing text was stuffed."""
+    def __init__(self):
+        self.context = ""
+
+    def invoke(self, inputs):
+        self.context = "\n\n".join(doc.page_content for doc in inputs["input_documents"])
+        return {"output_text": "30 days" if ANSWER in self.context else "I don't know"}
+
+
+def test_overlap_between_adjacent_chunks_is_removed():
+    first, second = splitter_chunks()[:2]
+    assert first[-50:] in second
+
+    docs, _ = compress_context([(Document(page_content=first), 0.9), (Document(page_content=second), 0.8)])
+
+    assert docs[0].page_content == first
+    assert docs[1].page_content in second
+    assert first[-50:] not in docs[1].page_content
+    assert len(docs[1].page_content) < len(second)
+
+
+def test_overlap_is_removed_when_later_chunk_ranks_first():
+    first, second = splitter_chunks()[:2]
+
+    docs, _ = compress_context([(Document(page_content=second), 0.9), (Document(page_content=first), 0.8)])
+
+    assert docs[0].page_content == second
+    assert second[:50] not in docs[1].page_content
+
+
+def test_duplicate_chunk_is_dropped():
+    chunk = splitter_chunks()[0]
+
+    docs, _ = compress_context([(Document(page_content=chunk), 0.9), (Document(page_content=chunk[100:400]), 0.8)])
+
+    assert [doc.page_content for doc in docs] == [chunk]
+
+
+def test_relevance_cutoff_drops_weak_hits():
+    docs, _ = compress_context(
+        [(Document(page_content="weak hit"), 0.1), (Document(page_content="strong hit"), 0.9)],
+        min_relevance=0.5,
+    )
+
+    assert [doc.page_content for doc in docs] == ["strong hit"]
+
+
+def test_top_hit_is_kept_below_cutoff():
+    docs, _ = compress_context(
+        [(Document(page_content="best hit"), 0.2), (Document(page_content="worse hit"), 0.1)],
+        min_relevance=0.5,
+    )
+
+    assert [doc.page_content for doc in docs] == ["best hit"]
+
+
+def test_budget_trims_at_word_boundary():
+    text = "alpha beta gamma delta epsilon zeta"
+
+    docs, _ = compress_context([(Document(page_content=text), 0.9)], token_budget=4)
+
+    assert docs[0].page_content == "alpha beta gamma"
+    assert text.startswith(docs[0].page_content + " ")
+
+
+def test_budget_stops_after_first_trimmed_chunk():
+    docs, _ = compress_context(
+        [(Document(page_content="alpha beta gamma delta"), 0.9), (Document(page_content="lambda mu nu"), 0.8)],
+        token_budget=5,
+    )
+
+    assert [doc.page_content for doc in docs] == ["alpha beta gamma"]
+
+
+def test_budget_always_keeps_top_hit():
+    docs, _ = compress_context([(Document(page_content="alpha beta gamma"), 0.9)], token_budget=1)
+
+    assert docs[0].page_content == "alph"
+
+
+@pytest.mark.parametrize("token_budget", [0, -10])
+def test_non_positive_budget_is_rejected(token_budget):
+    with pytest.raises(ValueError):
+        compress_context([(Document(page_content="alpha"), 0.9)], token_budget=token_budget)
+
+
+def test_no_cutoff_by_default():
+    docs, _ = compress_context([(Document(page_content="strong hit"), 0.9), (Document(page_content="weak hit"), 0.01)])
+
+    assert [doc.page_content for doc in docs] == ["strong hit", "weak hit"]
+
+
+def test_retrieval_settings_from_environment(monkeypatch):
+    for name in ["RAG_K", "RAG_MIN_RELEVANCE", "RAG_TOKEN_BUDGET"]:
+        monkeypatch.delenv(name, raising=False)
+    assert retrieval_settings("RAG") == {"k": 3, "min_relevance": None, "token_budget": None}
+
+    monkeypatch.setenv("RAG_K", "5")
+    monkeypatch.setenv("RAG_MIN_RELEVANCE", "0.4")
+    monkeypatch.setenv("RAG_TOKEN_BUDGET", "300")
+
+    assert retrieval_settings("RAG") == {"k": 5, "min_relevance": 0.4, "token_budget": 300}
+
+
+def test_no_budget_by_default():
+    chunks = splitter_chunks()[:3]
+
+    docs, _ = compress_context([(Document(page_content=chunk), 0.9) for chunk in chunks])
+
+    # Only the splitter overlap is removed; the chunks themselves are not cut
+    assert docs[0].page_content == chunks[0]
+    assert docs[-1].page_content == chunks[2][-len(docs[-1].page_content):]
+
+
+def test_report_counts_tokens_before_and_after():
+    question = "what is the return window?"
+    first, second = splitter_chunks()[:2]
+
+    docs, report = compress_context(
+        [(Document(page_content=first), 0.9), (Document(page_content=second), 0.8), (Document(page_content="noise"), 0.1)],
+        question,
+        min_relevance=0.3,
+    )
+
+    assert report["chunks_before"] == 3
+    assert report["chunks_after"] == 2
+    assert report["tokens_before"] == estimate_tokens(question) + estimate_tokens(first) + estimate_tokens(second) + estimate_tokens("noise")
+    assert report["tokens_after"] == estimate_tokens(question) + sum(estimate_tokens(doc.page_content) for doc in docs)
+    assert report["tokens_after"] < report["tokens_before"]
+
+
+def test_retrieve_context_respects_k():
+    chunks = splitter_chunks()
+    vectorstore = FakeVectorstore([(Document(page_content=chunk), 0.9 - i * 0.1) for i, chunk in enumerate(chunks)])
+
+    docs, report = retrieve_context(vectorstore, "question", k=2)
+
+    assert report["chunks_before"] == 2
+    assert len(docs) == 2
+
+
+@pytest.mark.parametrize("token_budget", [None, 400])
+def test_answer_bearing_chunk_still_reaches_the_prompt(token_budget):
+    chunks = splitter_chunks()
+    answer_chunk = next(chunk for chunk in chunks if ANSWER in chunk)
+    neighbours = [chunk for chunk in chunks if chunk != answer_chunk][:2]
+    scored = [(Document(page_content=answer_chunk), 0.9)] + [(Document(page_content=chunk), 0.6) for chunk in neighbours]
+
+    rag = RAG(token_budget=token_budget)
+    rag.vectorstore = FakeVectorstore(scored)
+    rag.qa_chain = RecordingQAChain()
+    rag.is_loaded = True
+
+    result = rag.ask_question("how long do I have to return an item?")
+
+    assert result["answer"] == "30 days"
+    assert result["prompt_tokens"]["tokens_after"] <= result["prompt_tokens"]["tokens_before"]
+
+
+def test_store_faq_answers_survive_default_compression():
+    """Fixed evaluation over data/store_qa.csv: every answer row reaches the prompt under the defaults."""
+    csv_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "store_qa.csv")
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    rows = splitter.split_documents(CSVLoader(file_path=csv_path).load())
+
+    for i, row in enumerate(rows):
+        # The answer row ranks first and its neighbours fill the rest of k, as a close retrieval would
+        neighbours = [rows[(i + 1) % len(rows)], rows[(i + 2) % len(rows)]]
+        scored = [(row, 0.5)] + [(doc, 0.4) for doc in neighbours]
+
+        docs, report = compress_context(scored, "question")
+
+        assert row.page_content in [doc.page_content for doc in docs]
+        assert report["tokens_after"] <= report["tokens_before"]